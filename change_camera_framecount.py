@@ -5,6 +5,10 @@ Resample a camera poses JSON to an exact target frame count while preserving tem
 The script expects a JSON with a top-level `poses` array where each pose is a 4x4 matrix
 (list of 4 lists of 4 numbers). It linearly interpolates translation and spherically
 interpolates rotation (via quaternion slerp) to produce exactly M poses.
+Rotations are interpolated with SciPy's `Slerp` when SciPy is installed, with
+numba-compiled kernels when only numba is, and with the NumPy implementation in
+this file otherwise. If `orjson` is installed it is used to read and write the
+JSON, otherwise the standard library `json` module is used.
 
 Usage:
   python3 change_camera_framecount.py -i cameras.json -o cameras_out.json -m 81
@@ -17,17 +21,30 @@ import os
 import sys
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from scipy.spatial.transform import Rotation, Slerp
+except ImportError:
+    Rotation = Slerp = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-def mat4_to_rt(mat):
-    R = np.array([[mat[i][j] for j in range(3)] for i in range(3)], dtype=float)
-    t = np.array([mat[i][3] for i in range(3)], dtype=float)
-    return R, t
 
+def _jit(fn):
+    # compile with numba when it is installed; the kernels are only used then
+    return njit(cache=True)(fn) if njit is not None else fn
 
-def rt_to_mat4(R, t):
-    M = [[float(R[i, j]) for j in range(3)] + [float(t[i])] for i in range(3)]
-    M.append([0.0, 0.0, 0.0, 1.0])
-    return M
+
+def mat4_to_rt(mat):
+    mat = np.asarray(mat, dtype=float)
+    return mat[:3, :3].copy(), mat[:3, 3].copy()
 
 
 def rot_to_quat(R):
@@ -62,6 +79,29 @@ def rot_to_quat(R):
     return q / np.linalg.norm(q)
 
 
+def rot_to_quat_batch(Rs):
+    # Shepperd's method: every row gets the four (unnormalized) candidates
+    # and keeps the one whose leading term 4w^2, 4x^2, 4y^2 or 4z^2 is largest
+    m00, m01, m02 = Rs[:, 0, 0], Rs[:, 0, 1], Rs[:, 0, 2]
+    m10, m11, m12 = Rs[:, 1, 0], Rs[:, 1, 1], Rs[:, 1, 2]
+    m20, m21, m22 = Rs[:, 2, 0], Rs[:, 2, 1], Rs[:, 2, 2]
+    t0 = 1.0 + m00 + m11 + m22
+    t1 = 1.0 + m00 - m11 - m22
+    t2 = 1.0 - m00 + m11 - m22
+    t3 = 1.0 - m00 - m11 + m22
+    a, b, c = m21 - m12, m02 - m20, m10 - m01
+    d, e, f = m01 + m10, m02 + m20, m12 + m21
+    cand = np.stack([
+        np.stack([t0, a, b, c], axis=-1),
+        np.stack([a, t1, d, e], axis=-1),
+        np.stack([b, d, t2, f], axis=-1),
+        np.stack([c, e, f, t3], axis=-1),
+    ], axis=1)
+    k = np.argmax(np.stack([t0, t1, t2, t3], axis=-1), axis=-1)
+    q = np.take_along_axis(cand, k[:, None, None], axis=1)[:, 0]
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
 def quat_to_rot(q):
     w, x, y, z = q
     ww, xx, yy, zz = w * w, x * x, y * y, z * z
@@ -75,58 +115,236 @@ def quat_to_rot(q):
     return R
 
 
+def quat_to_rot_batch(q, out=None):
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    ww, xx, yy, zz = w * w, x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+    R = np.empty((q.shape[0], 3, 3), dtype=float) if out is None else out
+    R[:, 0, 0] = ww + xx - yy - zz
+    R[:, 0, 1] = 2 * (xy - wz)
+    R[:, 0, 2] = 2 * (xz + wy)
+    R[:, 1, 0] = 2 * (xy + wz)
+    R[:, 1, 1] = ww - xx + yy - zz
+    R[:, 1, 2] = 2 * (yz - wx)
+    R[:, 2, 0] = 2 * (xz - wy)
+    R[:, 2, 1] = 2 * (yz + wx)
+    R[:, 2, 2] = ww - xx - yy + zz
+    return R
+
+
+def quat_norm(q):
+    w, x, y, z = q
+    return math.sqrt(w * w + x * x + y * y + z * z)
+
+
 def quat_slerp(q0, q1, t):
-    q0 = q0 / np.linalg.norm(q0)
-    q1 = q1 / np.linalg.norm(q1)
+    # scalar reference for the interpolation in interpolate_poses, which does not call it
+    q0 = q0 * (1.0 / quat_norm(q0))
+    q1 = q1 * (1.0 / quat_norm(q1))
     dot = float(np.dot(q0, q1))
     if dot < 0.0:
         q1 = -q1
         dot = -dot
     DOT_THRESHOLD = 0.9995
     if dot > DOT_THRESHOLD:
-        result = q0 + t * (q1 - q0)
-        return result / np.linalg.norm(result)
-    theta_0 = math.acos(max(min(dot, 1.0), -1.0))
+        result = (1.0 - t) * q0 + t * q1
+        return result * (1.0 / quat_norm(result))
+    theta_0 = math.acos(min(dot, 1.0))
     theta = theta_0 * t
     q2 = q1 - q0 * dot
-    q2 = q2 / np.linalg.norm(q2)
+    q2 *= 1.0 / quat_norm(q2)
     return q0 * math.cos(theta) + q2 * math.sin(theta)
 
 
+def quat_mul_batch(a, b):
+    aw, ax, ay, az = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bw, bx, by, bz = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def quat_log_batch(q):
+    # unit quaternions (K, 4) -> rotation axis times half-angle (K, 3)
+    v = q[:, 1:]
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    half = np.arctan2(n, q[:, :1])
+    return v * np.divide(half, n, out=np.ones_like(n), where=n > 0)
+
+
+def quat_exp_batch(v):
+    # inverse of quat_log_batch; sin(h) / h is taken from np.sinc to stay stable at 0
+    h = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.concatenate([np.cos(h), np.sinc(h / np.pi) * v], axis=-1)
+
+
+@_jit
+def _rot_to_quat_kernel(R, q):
+    trace = R[0, 0] + R[1, 1] + R[2, 2]
+    if trace > 0.0:
+        s = 0.5 / math.sqrt(trace + 1.0)
+        q[0] = 0.25 / s
+        q[1] = (R[2, 1] - R[1, 2]) * s
+        q[2] = (R[0, 2] - R[2, 0]) * s
+        q[3] = (R[1, 0] - R[0, 1]) * s
+    elif R[0, 0] > R[1, 1] and R[0, 0] > R[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + R[0, 0] - R[1, 1] - R[2, 2])
+        q[0] = (R[2, 1] - R[1, 2]) / s
+        q[1] = 0.25 * s
+        q[2] = (R[0, 1] + R[1, 0]) / s
+        q[3] = (R[0, 2] + R[2, 0]) / s
+    elif R[1, 1] > R[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + R[1, 1] - R[0, 0] - R[2, 2])
+        q[0] = (R[0, 2] - R[2, 0]) / s
+        q[1] = (R[0, 1] + R[1, 0]) / s
+        q[2] = 0.25 * s
+        q[3] = (R[1, 2] + R[2, 1]) / s
+    else:
+        s = 2.0 * math.sqrt(1.0 + R[2, 2] - R[0, 0] - R[1, 1])
+        q[0] = (R[1, 0] - R[0, 1]) / s
+        q[1] = (R[0, 2] + R[2, 0]) / s
+        q[2] = (R[1, 2] + R[2, 1]) / s
+        q[3] = 0.25 * s
+    n = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+    for c in range(4):
+        q[c] /= n
+
+
+@_jit
+def _quat_mul_kernel(a, b, q):
+    q[0] = a[0] * b[0] - a[1] * b[1] - a[2] * b[2] - a[3] * b[3]
+    q[1] = a[0] * b[1] + a[1] * b[0] + a[2] * b[3] - a[3] * b[2]
+    q[2] = a[0] * b[2] - a[1] * b[3] + a[2] * b[0] + a[3] * b[1]
+    q[3] = a[0] * b[3] + a[1] * b[2] - a[2] * b[1] + a[3] * b[0]
+
+
+@_jit
+def _quat_to_rot_kernel(q, R):
+    w, x, y, z = q[0], q[1], q[2], q[3]
+    R[0, 0] = w * w + x * x - y * y - z * z
+    R[0, 1] = 2 * (x * y - w * z)
+    R[0, 2] = 2 * (x * z + w * y)
+    R[1, 0] = 2 * (x * y + w * z)
+    R[1, 1] = w * w - x * x + y * y - z * z
+    R[1, 2] = 2 * (y * z - w * x)
+    R[2, 0] = 2 * (x * z - w * y)
+    R[2, 1] = 2 * (y * z + w * x)
+    R[2, 2] = w * w - x * x - y * y + z * z
+
+
+@_jit
+def _slerp_rotations_kernel(Rs, i_idx, alphas, out):
+    # rotation of output k: slerp(Rs[i], Rs[i + 1], alpha) written into out[k, :3, :3],
+    # evaluated as q_i * exp(alpha * log(conj(q_i) * q_{i+1}))
+    n = Rs.shape[0]
+    qs = np.empty((n, 4))
+    for k in range(n):
+        _rot_to_quat_kernel(Rs[k], qs[k])
+    omegas = np.empty((n - 1, 3))
+    conj = np.empty(4)
+    d = np.empty(4)
+    for s in range(n - 1):
+        conj[0] = qs[s, 0]
+        conj[1:] = -qs[s, 1:]
+        _quat_mul_kernel(conj, qs[s + 1], d)
+        if d[0] < 0.0:
+            # take the short arc
+            for c in range(4):
+                d[c] = -d[c]
+        vn = math.sqrt(d[1] * d[1] + d[2] * d[2] + d[3] * d[3])
+        scale = math.atan2(vn, d[0]) / vn if vn > 0.0 else 1.0
+        for c in range(3):
+            omegas[s, c] = d[c + 1] * scale
+    e = np.empty(4)
+    q = np.empty(4)
+    for k in range(i_idx.shape[0]):
+        i = i_idx[k]
+        vx = alphas[k] * omegas[i, 0]
+        vy = alphas[k] * omegas[i, 1]
+        vz = alphas[k] * omegas[i, 2]
+        h = math.sqrt(vx * vx + vy * vy + vz * vz)
+        sinc = math.sin(h) / h if h > 1e-12 else 1.0
+        e[0] = math.cos(h)
+        e[1] = sinc * vx
+        e[2] = sinc * vy
+        e[3] = sinc * vz
+        _quat_mul_kernel(qs[i], e, q)
+        _quat_to_rot_kernel(q, out[k, :3, :3])
+
+
+def load_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _ndarray_to_list(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(data, path, use_orjson=True):
+    # orjson writes ndarrays directly; the stdlib path converts them to lists
+    if use_orjson and orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        return
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, default=_ndarray_to_list)
+
+
+def interpolate_poses(arr, i, alpha):
+    # poses a fraction alpha of the way from arr[i] to arr[i + 1], as a (K, 4, 4) array
+    Rs = arr[:, :3, :3].copy()
+    ts = arr[:, :3, 3].copy()
+    out = np.zeros((len(i), 4, 4))
+    if Slerp is not None:
+        slerp = Slerp(np.arange(len(arr)), Rotation.from_matrix(Rs))
+        out[:, :3, :3] = slerp(i + alpha).as_matrix()
+    elif njit is not None:
+        _slerp_rotations_kernel(Rs, i, alpha, out)
+    else:
+        # slerp as q_i * exp(alpha * log(conj(q_i) * q_{i+1})): the log of every
+        # segment is taken once, leaving one exp per output
+        qs = rot_to_quat_batch(Rs)
+        d = quat_mul_batch(qs[:-1] * [1.0, -1.0, -1.0, -1.0], qs[1:])
+        d = np.where(d[:, :1] < 0.0, -d, d)
+        omega = quat_log_batch(d)
+        q = quat_mul_batch(qs[i], quat_exp_batch(alpha[:, None] * omega[i]))
+        quat_to_rot_batch(q, out=out[:, :3, :3])
+    out[:, :3, 3] = (1.0 - alpha[:, None]) * ts[i] + alpha[:, None] * ts[i + 1]
+    out[:, 3, 3] = 1.0
+    return out
+
+
 def resample_poses(poses, M):
     N = len(poses)
     if N == 0:
         raise ValueError("No poses to resample")
 
-    # convert to R, t, q arrays
-    Rs = []
-    ts = []
-    qs = []
-    for mat in poses:
-        R, t = mat4_to_rt(mat)
-        Rs.append(R)
-        ts.append(t)
-        qs.append(rot_to_quat(R))
-
-    Rs = np.array(Rs)
-    ts = np.array(ts)
-    qs = np.array(qs)
-
-    out = []
-    for k in range(M):
-        p = (k * N) / M
-        i = int(math.floor(p))
-        alpha = p - i
-
-        if i < 0:
-            out.append(poses[0])
-        elif i >= N - 1:
-            out.append(poses[-1])
-        else:
-            q = quat_slerp(qs[i], qs[i + 1], alpha)
-            t = (1.0 - alpha) * ts[i] + alpha * ts[i + 1]
-            R = quat_to_rot(q)
-            out.append(rt_to_mat4(R, t))
+    arr = np.array(poses, dtype=np.float64)
+    if M == N:
+        return arr
+
+    # fractional source position of every output frame
+    p = np.arange(M) * N / M
+    i = np.floor(p).astype(np.int64)
+    alpha = p - i
+
+    # positions on an input pose (every one for integer ratios) or at/past the
+    # last pose are plain copies; only the rest need interpolation
+    out = np.empty((M, 4, 4))
+    np.take(arr, np.minimum(i, N - 1), axis=0, out=out)
+    interp = np.flatnonzero((alpha > 1e-12) & (i < N - 1))
+    if interp.size:
+        out[interp] = interpolate_poses(arr, i[interp], alpha[interp])
 
     return out
 
@@ -136,14 +354,15 @@ def main():
     parser.add_argument('-i', '--input', required=True, help='Input cameras JSON')
     parser.add_argument('-o', '--output', required=True, help='Output cameras JSON')
     parser.add_argument('-m', '--frames', required=True, type=int, help='Target frame count')
+    parser.add_argument('--legacy-json', action='store_true',
+                        help='Write the output with the standard library json module instead of orjson')
     args = parser.parse_args()
 
     if not os.path.exists(args.input):
         print(f"Input not found: {args.input}", file=sys.stderr)
         sys.exit(2)
 
-    with open(args.input, 'r') as f:
-        data = json.load(f)
+    data = load_json(args.input)
 
     if 'poses' not in data:
         print("Input JSON does not contain 'poses' key", file=sys.stderr)
@@ -157,12 +376,11 @@ def main():
 
     out_poses = resample_poses(poses, M)
     data_out = dict(data)
-    data_out['poses'] = out_poses
+    data_out['poses'] = out_poses.tolist() if args.legacy_json else out_poses
     data_out['original_num_poses'] = len(poses)
     data_out['target_num_poses'] = M
 
-    with open(args.output, 'w') as f:
-        json.dump(data_out, f, indent=2)
+    dump_json(data_out, args.output, use_orjson=not args.legacy_json)
 
     print(f"Wrote {len(out_poses)} poses to {args.output}")
 
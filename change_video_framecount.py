@@ -3,94 +3,372 @@
 Resample a video's frames to an exact target frame count while preserving duration.
 
 Algorithm:
-- Load all frames, compute original frame count `N` and duration `T = N / fps`.
+- Compute original frame count `N` and duration `T = N / fps` (frames are only
+  loaded up front when the container does not report a frame count).
 - For target frame index k in [0..M-1], compute source position p = k * (N / M).
-- Interpolate between floor(p) and ceil(p) using linear blending (cv2.addWeighted).
+- Interpolate between floor(p) and ceil(p) using linear blending (cv2.addWeighted),
+  processed in chunks of output frames.
 - Write M frames with new fps = M / T so duration stays approximately the same.
+  Source frames are decoded on demand, so memory use does not grow with `N`.
 
 Usage example:
   python3 change_video_framecount.py -i input.mp4 -o output.mp4 -m 300
 
+With `--backend ffmpeg`, frames are decoded and encoded by an ffmpeg subprocess
+over rawvideo pipes (hardware decoding is used when available); ffmpeg is taken
+from PATH, or from the imageio-ffmpeg package. Output is yuv420p, so odd frame
+sizes are padded by one pixel to even. Without a usable hardware decoder ffmpeg
+prints "Device creation failed" and falls back to software decoding.
+
+Blending runs on a thread pool by default; `--jobs N` moves it to N worker
+processes that read source frames from shared memory.
+
 Note: This uses simple frame blending for interpolation (no optical-flow).
 """
 
 import argparse
-import math
+import contextlib
+import multiprocessing
+import shutil
+import subprocess
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 import cv2
+import numpy as np
 import os
 
 
-def resample_frames(input_path, output_path, target_frames, codec='mp4v'):
+def blend_frames(frames, i_idx, j_idx, alphas, umats=None, out=None):
+    # (1 - alpha) * frames[i] + alpha * frames[j] for a batch of output frames;
+    # umats, when given, holds the same frames already uploaded for OpenCL
+    if out is None:
+        out = np.empty((len(i_idx),) + frames.shape[1:], dtype=frames.dtype)
+    for n, (i, j, alpha) in enumerate(zip(i_idx, j_idx, alphas)):
+        if alpha <= 0:
+            out[n] = frames[i]
+        elif umats is not None:
+            out[n] = cv2.addWeighted(umats[i], 1.0 - float(alpha), umats[j], float(alpha), 0).get()
+        else:
+            cv2.addWeighted(frames[i], 1.0 - float(alpha), frames[j], float(alpha), 0, dst=out[n])
+    return out
+
+
+def find_ffmpeg():
+    exe = shutil.which('ffmpeg')
+    if exe is None:
+        try:
+            import imageio_ffmpeg
+        except ImportError:
+            raise RuntimeError("The ffmpeg backend needs ffmpeg on PATH or the imageio-ffmpeg package")
+        exe = imageio_ffmpeg.get_ffmpeg_exe()
+    return exe
+
+
+class FFmpegReader:
+    """cv2.VideoCapture-like reader decoding through an ffmpeg rawvideo pipe."""
+
+    def __init__(self, path, width, height):
+        if width <= 0 or height <= 0:
+            raise RuntimeError(f"Cannot determine frame size of {path}")
+        self.shape = (height, width, 3)
+        self.scratch = bytearray(width * height * 3)
+        # passthrough: emit exactly the coded frames, no duplicates/drops for VFR input
+        # (-vsync is deprecated in favour of -fps_mode, but older ffmpeg only knows -vsync)
+        cmd = [find_ffmpeg(), '-v', 'error', '-hwaccel', 'auto', '-i', path,
+               '-vsync', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+    def grab(self):
+        return self.proc.stdout.readinto(self.scratch) == len(self.scratch)
+
+    def read(self):
+        frm = np.empty(self.shape, dtype=np.uint8)
+        if self.proc.stdout.readinto(memoryview(frm).cast('B')) < frm.nbytes:
+            return False, None
+        return True, frm
+
+    def release(self):
+        # stop ffmpeg before closing the pipe so an early release is not an error
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+
+class FFmpegWriter:
+    """cv2.VideoWriter-like writer encoding through an ffmpeg rawvideo pipe."""
+
+    def __init__(self, path, codec, fps, size):
+        width, height = size
+        cmd = [find_ffmpeg(), '-v', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-']
+        if width % 2 or height % 2:
+            # yuv420p needs even dimensions; pad by one pixel rather than let the encoder fail
+            cmd += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        cmd += ['-c:v', codec, '-pix_fmt', 'yuv420p']
+        if codec in ('libx264', 'libx265'):
+            cmd += ['-preset', 'fast']
+        cmd += [path]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg exited with status {self.proc.wait()}") from None
+
+    def release(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with status {self.proc.returncode}")
+
+
+# ring slots this worker process has mapped, by name
+_attached = {}
+
+
+def slot_views(shm, chunk_size, frame_shape):
+    # a ring slot holds a source window of up to 2 * chunk_size frames followed
+    # by room for chunk_size blended frames
+    frames = np.ndarray((3 * chunk_size,) + frame_shape, dtype=np.uint8, buffer=shm.buf)
+    return frames[:2 * chunk_size], frames[2 * chunk_size:]
+
+
+def blend_shared(shm_name, chunk_size, frame_shape, n_window, i_idx, j_idx, alphas, use_opencl=False):
+    # process-pool entry point: blend_frames from a shared-memory ring slot back
+    # into the same slot, so no frames travel through the result pipe
+    if shm_name not in _attached:
+        _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+    window, out = slot_views(_attached[shm_name], chunk_size, frame_shape)
+    window = window[:n_window]
+    # UMats cannot be handed between processes, so each chunk uploads its own window
+    umats = [cv2.UMat(f) for f in window] if use_opencl else None
+    blend_frames(window, i_idx, j_idx, alphas, umats, out=out[:len(i_idx)])
+
+
+def release_shared(shm):
+    shm.unlink()
+    # views left behind by a failed chunk keep the mapping alive; it goes with them
+    with contextlib.suppress(BufferError):
+        shm.close()
+
+
+def read_frames(cap):
+    while True:
+        ret, frm = cap.read()
+        if not ret:
+            return
+        yield frm
+
+
+class StreamedFrames:
+    """Serve frames of an open capture by non-decreasing index.
+
+    Frames that are never requested are skipped with grab() instead of being
+    decoded, and only the two most recently decoded frames are kept.
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.pos = -1
+        self.cache = {}
+
+    def get(self, idx):
+        if idx in self.cache:
+            return self.cache[idx]
+        if idx < self.pos:
+            raise RuntimeError(f"Frame {idx} is no longer available")
+        ret = True
+        while ret and self.pos < idx - 1:
+            ret = self.cap.grab()
+            self.pos += ret
+        if ret:
+            ret, frm = self.cap.read()
+        if not ret:
+            # metadata overstated the frame count; hold the last decoded frame
+            if not self.cache:
+                raise RuntimeError("Input video contains no frames.")
+            return self.cache[max(self.cache)]
+        self.pos += 1
+        self.cache[self.pos] = frm
+        if len(self.cache) > 2:
+            del self.cache[min(self.cache)]
+        return frm
+
+    def take(self, indices, axis=0, out=None):
+        # same call as ndarray.take, so either frame source can fill a buffer in place
+        return np.stack([self.get(i) for i in indices], axis=axis, out=out)
+
+    def __getitem__(self, indices):
+        return self.take(indices)
+
+
+def write_chunk(out, repeat, blended, frame):
+    # blended holds one frame per False entry of repeat; True repeats the last one
+    blended = iter(blended)
+    for rep in repeat:
+        if not rep:
+            frame = next(blended)
+        out.write(frame)
+    return frame
+
+
+def resample_frames(input_path, output_path, target_frames, codec=None, chunk_size=16, workers=None,
+                    backend='opencv', opencl=False, jobs=None, max_memory=2 << 30):
+    if backend not in ('opencv', 'ffmpeg'):
+        raise ValueError(f"Unknown backend: {backend}")
+
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         raise RuntimeError(f"Cannot open input video: {input_path}")
 
-    fps_orig = cap.get(cv2.CAP_PROP_FPS) or 0.0
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
-
-    # Fallback: read frames to count if metadata missing
-    frames = []
-    if frame_count <= 0:
-        while True:
-            ret, frm = cap.read()
-            if not ret:
-                break
-            frames.append(frm)
-        frame_count = len(frames)
-        if frame_count == 0:
-            raise RuntimeError("Input video contains no frames.")
-        # estimate fps if unknown
+    out = None
+    try:
+        fps_orig = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+
+        if backend == 'ffmpeg':
+            # OpenCV only probes the metadata; frames are decoded by ffmpeg
+            cap.release()
+            cap = FFmpegReader(input_path, width, height)
+
+        if frame_count > 0:
+            # decode frames lazily as the output needs them
+            frames = StreamedFrames(cap)
+        else:
+            # no reported frame count: N is only known after decoding everything
+            frames = list(read_frames(cap))
+            frame_count = len(frames)
+            if frame_count == 0:
+                raise RuntimeError("Input video contains no frames.")
+            frames = np.stack(frames)
+
+        # take the size from a decoded frame and assume 30 fps if the rate is unknown
+        height, width = frames[[0]].shape[1:3]
         if fps_orig <= 0.0:
             fps_orig = 30.0
-        cap.release()
-    else:
-        # read frames into memory
-        while True:
-            ret, frm = cap.read()
-            if not ret:
-                break
-            frames.append(frm)
-        cap.release()
 
-    if width == 0 or height == 0:
-        h, w = frames[0].shape[:2]
-        width, height = w, h
-
-    N = frame_count
-    M = int(target_frames)
-    if M <= 0:
-        raise ValueError("target_frames must be > 0")
-
-    duration = N / fps_orig if fps_orig > 0 else float(N)
-    fps_new = M / duration if duration > 0 else fps_orig
-
-    fourcc = cv2.VideoWriter_fourcc(*codec)
-    out = cv2.VideoWriter(output_path, fourcc, float(fps_new), (width, height))
-    if not out.isOpened():
-        raise RuntimeError(f"Cannot open output for writing: {output_path}")
-
-    # Map each output index k -> fractional source position p
-    for k in range(M):
-        p = (k * N) / M
-        i = int(math.floor(p))
-        alpha = p - i
-
-        if i < 0:
-            frame = frames[0]
-        elif i >= N - 1:
-            frame = frames[-1]
+        N = frame_count
+        M = int(target_frames)
+        if M <= 0:
+            raise ValueError("target_frames must be > 0")
+
+        duration = N / fps_orig
+        fps_new = M / duration
+
+        if backend == 'ffmpeg':
+            out = FFmpegWriter(output_path, codec or 'libx264', float(fps_new), (width, height))
         else:
-            a = frames[i]
-            b = frames[i + 1]
-            # linear blend; alpha=0 -> a, alpha=1 -> b
-            frame = cv2.addWeighted(a, 1.0 - alpha, b, alpha, 0)
+            fourcc = cv2.VideoWriter_fourcc(*(codec or 'mp4v'))
+            out = cv2.VideoWriter(output_path, fourcc, float(fps_new), (width, height))
+        if not out.isOpened():
+            raise RuntimeError(f"Cannot open output for writing: {output_path}")
 
-        out.write(frame)
+        # Map each output index k -> fractional source position p
+        ps = np.arange(M) * N / M
+        i_idx = np.floor(ps).astype(np.int64)
+        alphas = ps - i_idx
+        tail = i_idx >= N - 1
+        i_idx[tail] = N - 1
+        alphas[tail] = 0.0
+        j_idx = np.minimum(i_idx + 1, N - 1)
+        # outputs identical to their predecessor reuse it instead of blending again
+        repeat = np.zeros(M, dtype=bool)
+        repeat[1:] = (i_idx[1:] == i_idx[:-1]) & (alphas[1:] == alphas[:-1])
+
+        # Blend chunks on a thread pool (cv2.addWeighted releases the GIL), or on
+        # `jobs` worker processes, while this thread writes finished chunks in order
+        if jobs:
+            workers = jobs
+            pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            workers = workers or os.cpu_count() or 1
+            pool = ThreadPoolExecutor(max_workers=workers)
+        # a chunk holds chunk_size blended frames plus a source window of up to
+        # 2 * chunk_size frames (with M < N every output may need two sources of its
+        # own); keep two chunks per worker in flight, within max_memory bytes
+        chunk_bytes = 3 * chunk_size * height * width * 3
+        max_in_flight = max(1, min(2 * workers, max_memory // chunk_bytes))
+        use_opencl = opencl and cv2.ocl.haveOpenCL()
+        uploaded = {}
+        frame_shape = (height, width, 3)
+        # worker processes share a fixed ring of chunk_bytes slots with this one;
+        # a slot is busy from submit until its chunk is written
+        ring = []
+        if jobs:
+            ring = [shared_memory.SharedMemory(create=True, size=chunk_bytes)
+                    for _ in range(max_in_flight + 1)]
+        free = list(range(len(ring)))
+        frame = None
+        pending = deque()
 
-    out.release()
+        def write_oldest(frame):
+            rep, fut, slot = pending.popleft()
+            if slot is None:
+                return write_chunk(out, rep, fut.result() if fut else (), frame)
+            fut.result()
+            frame = write_chunk(out, rep, slot_views(ring[slot], chunk_size, frame_shape)[1], frame)
+            free.append(slot)
+            # the slot is about to be reused; later repeats need a copy of its last frame
+            return frame.copy()
+
+        try:
+            with pool:
+                for lo in range(0, M, chunk_size):
+                    hi = min(lo + chunk_size, M)
+                    sel = lo + np.flatnonzero(~repeat[lo:hi])
+                    fut = slot = None
+                    if sel.size:
+                        i_sel, j_sel, a_sel = i_idx[sel], j_idx[sel], alphas[sel]
+                        # hand the pool only the source frames this chunk blends
+                        needed = np.unique(np.concatenate([i_sel, j_sel[a_sel > 0]]))
+                        i_loc = np.searchsorted(needed, i_sel)
+                        j_loc = np.where(a_sel > 0, np.searchsorted(needed, j_sel), i_loc)
+                        if jobs:
+                            slot = free.pop()
+                            window = slot_views(ring[slot], chunk_size, frame_shape)[0][:len(needed)]
+                            frames.take(needed, axis=0, out=window)
+                            del window
+                            fut = pool.submit(blend_shared, ring[slot].name, chunk_size, frame_shape,
+                                              len(needed), i_loc, j_loc, a_sel, use_opencl)
+                        else:
+                            window = frames[needed]
+                            umats = None
+                            if use_opencl:
+                                # upload each source frame once; consecutive chunks share at
+                                # most their boundary frames, so the last two uploads suffice
+                                keys = needed.tolist()
+                                umats = [uploaded[k] if k in uploaded else cv2.UMat(f)
+                                         for k, f in zip(keys, window)]
+                                uploaded = dict(zip(keys[-2:], umats[-2:]))
+                            fut = pool.submit(blend_frames, window, i_loc, j_loc, a_sel, umats)
+                    # a chunk without fut repeats the previous output throughout
+                    pending.append((repeat[lo:hi], fut, slot))
+                    while len(pending) > max_in_flight:
+                        frame = write_oldest(frame)
+                while pending:
+                    frame = write_oldest(frame)
+        finally:
+            for shm in ring:
+                release_shared(shm)
+    except BaseException:
+        if out is not None:
+            # don't let a failing encoder hide the original error
+            with contextlib.suppress(Exception):
+                out.release()
+        raise
+    else:
+        out.release()
+    finally:
+        # also stops the ffmpeg decoder when the pipeline fails part-way
+        cap.release()
 
 
 def main():
@@ -98,7 +376,15 @@ def main():
     parser.add_argument('-i', '--input', required=True, help='Input video path')
     parser.add_argument('-o', '--output', required=True, help='Output video path')
     parser.add_argument('-m', '--frames', required=True, type=int, help='Target frame count (exact)')
-    parser.add_argument('--codec', default='mp4v', help='FourCC codec (default mp4v)')
+    parser.add_argument('--codec', default=None,
+                        help='FourCC codec for the opencv backend (default mp4v), '
+                             'or ffmpeg encoder name for the ffmpeg backend (default libx264)')
+    parser.add_argument('--backend', default='opencv', choices=['opencv', 'ffmpeg'],
+                        help='Decode/encode with OpenCV or through an ffmpeg subprocess (default opencv)')
+    parser.add_argument('--opencl', action='store_true',
+                        help='Blend frames on the GPU through OpenCV\'s OpenCL (UMat) path when available')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Blend in this many worker processes instead of a thread pool')
 
     args = parser.parse_args()
 
@@ -107,7 +393,8 @@ def main():
         sys.exit(2)
 
     try:
-        resample_frames(args.input, args.output, args.frames, codec=args.codec)
+        resample_frames(args.input, args.output, args.frames, codec=args.codec, backend=args.backend,
+                        opencl=args.opencl, jobs=args.jobs)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)